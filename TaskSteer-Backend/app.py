@@ -1,10 +1,14 @@
 import os
 import datetime
 import json
+import queue
 import re
+import threading
+import time
 import traceback # For detailed error logging
 
-from flask import Flask, request, jsonify
+import click
+from flask import Flask, request, Response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
@@ -17,6 +21,13 @@ import google.generativeai as genai
 import PyPDF2
 import docx
 
+# Response serialization (orjson / MessagePack with Firestore timestamp handling)
+from serialization import negotiate_mimetype, serialize
+# Background cleanup of soft-deleted lists and tasks
+from compaction import TombstoneCompactor, DEFAULT_CHECKPOINT_PATH
+# Versioned Gemini prompt templates
+from prompts import TASK_EXTRACTION, STATUS_SUGGESTION, VALID_STATUSES
+
 print("📁 Current working directory:", os.getcwd())
 
 # === CONFIGURE GEMINI ===
@@ -26,13 +37,25 @@ GOOGLE_API_KEY = "" # <--- REPLACE THIS or load from environment
 if GOOGLE_API_KEY == "YOUR_GOOGLE_API_KEY":
     print("⚠️ WARNING: Please replace 'YOUR_GOOGLE_API_KEY' with your actual Google API Key for Gemini.")
 
+GEMINI_MODEL_NAME = "models/gemini-1.5-flash"
+
+def build_gemini_model(template):
+    # See prompts.py for how the system instruction is billed.
+    return genai.GenerativeModel(
+        GEMINI_MODEL_NAME,
+        system_instruction=template.system_instruction,
+        generation_config=template.generation_config,
+    )
+
 try:
     genai.configure(api_key=GOOGLE_API_KEY)
-    model = genai.GenerativeModel("models/gemini-1.5-flash")
+    extraction_model = build_gemini_model(TASK_EXTRACTION)
+    status_model = build_gemini_model(STATUS_SUGGESTION)
     print("✅ Gemini Model initialized successfully.")
 except Exception as e:
     print(f"🔥❌❌❌ Gemini Model Initialization Error: {e} ❌❌❌🔥")
-    model = None
+    extraction_model = None
+    status_model = None
 
 # === INITIALIZE FIRESTORE ===
 db = None
@@ -66,6 +89,18 @@ CORS(app, resources={r"/*": {"origins": [
 print("✅ Flask App initialized with CORS for all routes.")
 
 
+# === RESPONSE SERIALIZATION ===
+def respond(payload):
+    """
+    Drop-in replacement for jsonify. Uses the fast encoder from serialization.py
+    and returns MessagePack when the client's Accept header asks for it.
+    """
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    response = Response(serialize(payload, mimetype), mimetype=mimetype)
+    response.vary.add("Accept")
+    return response
+
+
 # === AUTHENTICATION DECORATOR (NEW AND IMPORTANT!) ===
 from functools import wraps
 
@@ -74,11 +109,11 @@ def check_token(f):
     def wrap(*args,**kwargs):
         # Allow OPTIONS requests to pass through for CORS preflight
         if request.method == "OPTIONS":
-            return jsonify({'message': 'CORS preflight successful'}), 204
+            return respond({'message': 'CORS preflight successful'}), 204
 
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'message': 'Missing or invalid authorization token'}), 401
+            return respond({'message': 'Missing or invalid authorization token'}), 401
         
         id_token = auth_header.split('Bearer ')[1]
         try:
@@ -86,91 +121,119 @@ def check_token(f):
             # Add user info to the request context for use in the endpoint
             request.user = decoded_token
         except auth.InvalidIdTokenError:
-            return jsonify({'message': 'Invalid ID token'}), 401
+            return respond({'message': 'Invalid ID token'}), 401
         except Exception as e:
             print(f"🔥❌ Token verification error: {e}")
-            return jsonify({'message': 'Could not verify token'}), 401
+            return respond({'message': 'Could not verify token'}), 401
         
         return f(*args, **kwargs)
     return wrap
 
-# === GEMINI TASK EXTRACTOR (UPDATED) ===
-def extract_tasks_with_gemini(transcript_text_value: str, meeting_date_value: str):
-    if not model:
-        print("❌ Gemini model not initialized. Cannot extract tasks.")
-        return []
-    
-    prompt = f"""
-You are a hyper-attentive Task Analyst Engine. Your primary function is to process unstructured transcripts and extract tasks with actionable intelligence. You operate under a **Zero-Miss Directive** for finding tasks and a **Full-Context Mandate** for describing them. You MUST identify every commitment, enrich it, and assign a status. You do not explain yourself; you only output the final JSON.
-
----
-### Core Protocol: From Identification to Output
-
-**1. Aggressive Task Identification:**
-Find any statement that implies future work. This includes direct commands ("Send me the file"), pledges ("I will do it"), and implied actions.
-
-**2. Contextual Intelligence Gathering (FOR THE `description` FIELD):**
-For EVERY task, find the **'why'** behind it by searching the surrounding sentences. A good description answers "Why is this task being done?". If no context exists, use an empty string `""`.
-
-**3. Status Assignment (FOR THE `status` FIELD - CRITICAL RULE):**
-You MUST analyze the language of the task assignment to determine its status. Assign ONE of the following values: `High Priority`, `To Do`, `In Progress`, `Review`, or `Completed`.
-
-* **`High Priority`**: Assign this for tasks with words like "urgent," "ASAP," "critical," "immediately," "top priority," or "needs to be done first."
-* **`In Progress`**: Assign this if the speaker mentions they have already started the work (e.g., "I'm already working on the slides," "I've started pulling the data").
-* **`Review`**: Assign this for tasks that involve checking, approving, or reviewing someone else's work (e.g., "Send me the draft for review," "Can you look this over?").
-* **`Completed`**: Assign this only if the speaker explicitly states the task is already finished (e.g., "I've already sent the report," "That's done.").
-* **`To Do`**: This is the **default status**. Use it for any standard task that does not meet the criteria for the other statuses.
+# === GEMINI TOKEN ACCOUNTING ===
+# Usage records are queued and written to the 'llm_usage' collection in batches
+# by a background thread, so Gemini routes never wait on a Firestore round trip.
+LLM_USAGE_BATCH_SIZE = 100
+llm_usage_queue = queue.Queue(maxsize=10000)
 
-**4. Data Point Extraction & Formatting:**
-For every identified task, you must extract these five data points:
+def llm_usage_writer():
+    while True:
+        records = [llm_usage_queue.get()]
+        while len(records) < LLM_USAGE_BATCH_SIZE:
+            try:
+                records.append(llm_usage_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            batch = db.batch()
+            for record in records:
+                batch.set(db.collection("llm_usage").document(), record)
+            batch.commit()
+        except Exception as e:
+            print(f"⚠️ Failed to write {len(records)} Gemini usage record(s): {e}")
 
--   **task:** The concise imperative command (e.g., "Draft the Q3 marketing report").
--   **assignee:** The responsible person or team (e.g., "Sarah", "Marketing", "Unassigned").
--   **deadline:** The calculated `YYYY-MM-DD` date. Use `""` if not specified.
--   **description:** The synthesized context you gathered in Step 2.
--   **status:** The status you determined in Step 3.
+if db:
+    threading.Thread(target=llm_usage_writer, name="llm-usage-writer", daemon=True).start()
 
----
-### **Final Output Specification**
+def record_llm_usage(template, response, latency_ms, error=None):
+    """
+    Logs token counts, latency and any error of one Gemini call, tagged with the
+    route, user and prompt version, and queues it for 'llm_usage'. Never fails the request.
+    """
+    try:
+        usage = getattr(response, "usage_metadata", None)
+        user = getattr(request, "user", None) or {}
+        record = {
+            "route": request.path,
+            "user_id": user.get("uid"),
+            "prompt": template.name,
+            "prompt_version": template.version,
+            "model": GEMINI_MODEL_NAME,
+            "input_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+            "cached_input_tokens": getattr(usage, "cached_content_token_count", 0) or 0,
+            "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+            "total_tokens": getattr(usage, "total_token_count", 0) or 0,
+            "latency_ms": round(latency_ms, 1),
+            "error": error,
+            "created_at": firestore.SERVER_TIMESTAMP,
+        }
+        print(f"📊 {template.id} on {record['route']}: {record['input_tokens']} in / "
+              f"{record['output_tokens']} out tokens, {record['latency_ms']} ms"
+              f"{f', error: {error}' if error else ''}")
+        if db:
+            llm_usage_queue.put_nowait(record)
+    except queue.Full:
+        print("⚠️ Gemini usage queue is full, dropping record.")
+    except Exception as e:
+        print(f"⚠️ Failed to record Gemini usage: {e}")
 
-**Schema:** A raw JSON array of objects. The output MUST start with `[` and end with `]`.
+def generate_with_template(gemini_model, template, **values):
+    started = time.perf_counter()
+    response = None
+    error = None
+    try:
+        response = gemini_model.generate_content(template.render(**values))
+        return response
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        # Failed calls are recorded too, so latency and error rates per prompt version aren't skewed.
+        record_llm_usage(template, response, (time.perf_counter() - started) * 1000, error)
 
-**Required Keys per object:** `task`, `assignee`, `deadline`, `description`, `status`.
+# === GEMINI TASK EXTRACTOR (UPDATED) ===
+def extract_tasks_with_gemini(transcript_text_value: str, meeting_date_value: str):
+    if not extraction_model:
+        print("❌ Gemini model not initialized. Cannot extract tasks.")
+        return []
 
----
-**Transcript to Analyze:**
-{transcript_text_value}
-"""
+    response = None
     try:
-        response = model.generate_content(prompt)
-        # Convert the response to a dictionary to handle the new parsing logic
-        gemini_response = json.loads(response.text)
-        
-        # ✅ FIX: Use the new, more robust parsing function.
+        response = generate_with_template(
+            extraction_model, TASK_EXTRACTION,
+            meeting_date=meeting_date_value, transcript=transcript_text_value,
+        )
+        # Structured output mode: the response text is the JSON array itself.
+        task_list = json.loads(response.text)
+        if not isinstance(task_list, list):
+            print(f"❌ Gemini returned {type(task_list).__name__} instead of a task array.")
+            return []
+
         parsed_tasks = []
-        for item in gemini_response.get("candidates", []):
-            try:
-                content = item["content"]["parts"][0]["text"]
-                # Clean up the content string before parsing
-                clean_content = content.strip().replace('```json', '').replace('```', '')
-                task_list = json.loads(clean_content) if isinstance(clean_content, str) else clean_content
-            except Exception as e:
-                print("❌ Failed to parse Gemini content:", e)
+        for task in task_list:
+            if not isinstance(task, dict):
                 continue
+            parsed_tasks.append({
+                "title": task.get("task") or task.get("title") or "Untitled Task",
+                "description": task.get("description") or "No description provided.",
+                "due_date": task.get("deadline") or task.get("due_date") or None,
+                "assignee": task.get("assignee") or None,
+                "status": task.get("status", "To Do") # Keep status parsing
+            })
 
-            for task in task_list:
-                parsed_tasks.append({
-                    "title": task.get("task") or task.get("title") or "Untitled Task",
-                    "description": task.get("description") or "No description provided.",
-                    "due_date": task.get("deadline") or task.get("due_date") or None,
-                    "assignee": task.get("assignee") or None,
-                    "status": task.get("status", "To Do") # Keep status parsing
-                })
-        
         return parsed_tasks
 
     except json.JSONDecodeError as je:
-        print(f"❌ Gemini JSON Decode Error: {je}. Attempted to parse: {response.text}")
+        print(f"❌ Gemini JSON Decode Error: {je}. Attempted to parse: {response.text if response else None}")
         return []
     except Exception as e:
         print(f"❌ Gemini General Error in extract_tasks_with_gemini: {e}")
@@ -181,15 +244,15 @@ For every identified task, you must extract these five data points:
 
 @app.route("/")
 def index():
-    return jsonify({"message": "🚀 TaskSteer backend is running."}), 200
+    return respond({"message": "🚀 TaskSteer backend is running."}), 200
 
 # This route handles CORS preflight for the login flow.
 @app.route('/login', methods=['POST', 'OPTIONS'])
 def login():
     if request.method == 'OPTIONS':
-        return jsonify({'message': 'CORS preflight successful'}), 200
+        return respond({'message': 'CORS preflight successful'}), 200
     
-    return jsonify({
+    return respond({
         "message": "Login endpoint reached. Please use Firebase Auth on the frontend to get an ID token and send it as a 'Bearer' token to other API routes."
     }), 200
 
@@ -197,42 +260,37 @@ def login():
 @app.route("/suggest-status", methods=["POST", "OPTIONS"])
 @check_token
 def suggest_status():
-    if not model:
-        return jsonify({"error": "AI model not initialized"}), 500
+    if not status_model:
+        return respond({"error": "AI model not initialized"}), 500
 
     try:
         data = request.get_json()
         if not data or "title" not in data:
-            return jsonify({"error": "Task title is required."}), 400
+            return respond({"error": "Task title is required."}), 400
         
         task_title = data.get("title")
         task_description = data.get("description", "")
 
-        prompt = f"""
-Analyze the following task and suggest the most appropriate status.
-Your response must be ONLY ONE of the following exact strings: 'High Priority', 'To Do', 'In Progress', 'Review', or 'Completed'. Do not add any other text or explanation.
-
-Task Title: "{task_title}"
-Task Description: "{task_description}"
-
-Based on the content, keywords like 'urgent', 'review', 'already started', or 'finished' should guide your choice. Default to 'To Do' if no other status fits.
-
-Suggested Status:
-"""
-        response = model.generate_content(prompt)
-        suggested_status = response.text.strip()
+        response = generate_with_template(
+            status_model, STATUS_SUGGESTION, title=task_title, description=task_description,
+        )
+        try:
+            suggestion = json.loads(response.text)
+        except json.JSONDecodeError as je:
+            print(f"❌ Gemini JSON Decode Error: {je}. Attempted to parse: {response.text}")
+            suggestion = {}
+        suggested_status = suggestion.get("suggested_status") if isinstance(suggestion, dict) else None
 
-        valid_statuses = ['High Priority', 'To Do', 'In Progress', 'Review', 'Completed']
-        if suggested_status not in valid_statuses:
+        if suggested_status not in VALID_STATUSES:
             print(f"⚠️ AI returned an invalid status: '{suggested_status}'. Defaulting to 'To Do'.")
             suggested_status = 'To Do'
 
         print(f"✅ AI suggested status for user {request.user['uid']}: {suggested_status}")
-        return jsonify({"suggested_status": suggested_status})
+        return respond({"suggested_status": suggested_status})
 
     except Exception as e:
         print(f"🔥❌ /suggest-status Error: {e}"); traceback.print_exc()
-        return jsonify({"error": f"Failed to get AI suggestion: {str(e)}"}), 500
+        return respond({"error": f"Failed to get AI suggestion: {str(e)}"}), 500
 
 # === HELPER FUNCTION FOR UPLOAD ROUTE ===
 def normalize_assignee(raw_assignee, current_user_email):
@@ -257,14 +315,14 @@ def normalize_assignee(raw_assignee, current_user_email):
 def upload_transcript():
     print(f"🔥 /upload endpoint hit by user: {request.user['uid']}")
     if not db:
-        return jsonify({"message": "❌ Database not initialized. Cannot process upload."}), 500
+        return respond({"message": "❌ Database not initialized. Cannot process upload."}), 500
 
     if 'file' not in request.files:
-        return jsonify({"message": "No file part in the request."}), 400
+        return respond({"message": "No file part in the request."}), 400
 
     file = request.files['file']
     if file.filename == '':
-        return jsonify({"message": "No selected file."}), 400
+        return respond({"message": "No selected file."}), 400
 
     try:
         content = ""
@@ -279,10 +337,10 @@ def upload_transcript():
         elif filename.endswith('.txt'):
             content = file.read().decode("utf-8")
         else:
-            return jsonify({"message": f"Unsupported file type: {filename}."}), 400
+            return respond({"message": f"Unsupported file type: {filename}."}), 400
         
         if not content.strip():
-            return jsonify({"message": "File is empty or text could not be extracted."}), 400
+            return respond({"message": "File is empty or text could not be extracted."}), 400
             
         meeting_date = request.form.get("meeting_date", datetime.date.today().isoformat())
         
@@ -290,12 +348,12 @@ def upload_transcript():
         tasks_from_gemini = extract_tasks_with_gemini(content, meeting_date)
 
         if not tasks_from_gemini:
-            return jsonify({"message": "No valid tasks were extracted from the document."}), 200
+            return respond({"message": "No valid tasks were extracted from the document."}), 200
         else:
             print(f"✅ Extracted {len(tasks_from_gemini)} tasks:", tasks_from_gemini)
 
         action = request.form.get('action')
-        if not action: return jsonify({"message": "❌ Missing 'action' in form data."}), 400
+        if not action: return respond({"message": "❌ Missing 'action' in form data."}), 400
 
         timestamp = firestore.SERVER_TIMESTAMP
         user_id = request.user["uid"]
@@ -321,7 +379,7 @@ def upload_transcript():
                 })
             batch.commit()
             print(f"✅ Added {len(tasks_from_gemini)} task(s) to personal tasks for user {user_id}.")
-            return jsonify({"message": f"✅ Added {len(tasks_from_gemini)} task(s) to your personal tasks."}), 200
+            return respond({"message": f"✅ Added {len(tasks_from_gemini)} task(s) to your personal tasks."}), 200
 
         elif action == 'newList' or action == 'existingList':
             list_ref = None
@@ -342,14 +400,15 @@ def upload_transcript():
                 list_id = list_ref.id
             else: # existingList
                 list_id = request.form.get("list_id")
-                if not list_id: return jsonify({"message": "❌ Missing 'list_id' for existing list."}), 400
+                if not list_id: return respond({"message": "❌ Missing 'list_id' for existing list."}), 400
                 list_ref = db.collection("shared_lists").document(list_id)
                 list_doc = list_ref.get()
-                if not list_doc.exists: return jsonify({"message": f"❌ List with ID '{list_id}' not found."}), 404
+                if not list_doc.exists or list_doc.to_dict().get("deleted"):
+                    return respond({"message": f"❌ List with ID '{list_id}' not found."}), 404
                 list_data = list_doc.to_dict()
                 list_name = list_data.get("name", "Untitled List")
                 if user_email not in list_data.get("members", []):
-                    return jsonify({"message": "You are not a member of this list."}), 403
+                    return respond({"message": "You are not a member of this list."}), 403
             
             batch = db.batch()
             for t_gemini in tasks_from_gemini:
@@ -374,21 +433,21 @@ def upload_transcript():
             count = len(tasks_from_gemini)
             if action == 'newList':
                 print(f"✅ User {user_id} created new list '{list_name}' ({list_id}) with {count} task(s).")
-                return jsonify({"message": f"✅ Created new list '{list_name}' with {count} task(s).", "new_list_id": list_id}), 200
+                return respond({"message": f"✅ Created new list '{list_name}' with {count} task(s).", "new_list_id": list_id}), 200
             else:
                 print(f"✅ User {user_id} added {count} task(s) to existing list ID: {list_id}.")
-                return jsonify({"message": f"✅ Added {count} task(s) to the list."}), 200
+                return respond({"message": f"✅ Added {count} task(s) to the list."}), 200
         else:
-            return jsonify({"message": f"❌ Invalid action type: {action}."}), 400
+            return respond({"message": f"❌ Invalid action type: {action}."}), 400
 
     except Exception as e:
         print(f"🔥❌ /upload Error: {str(e)}"); traceback.print_exc()
-        return jsonify({"message": f"❌ Server error during upload: {str(e)}"}), 500
+        return respond({"message": f"❌ Server error during upload: {str(e)}"}), 500
 
 @app.route("/tasks", methods=["GET", "OPTIONS"])
 @check_token
 def get_tasks():
-    if not db: return jsonify({"error": "Database not initialized"}), 500
+    if not db: return respond({"error": "Database not initialized"}), 500
     
     try:
         user_id = request.user["uid"]
@@ -420,20 +479,20 @@ def get_tasks():
         all_tasks = personal_tasks_list + shared_tasks_list
         
         # Return a raw list as requested by the user's snippet
-        return jsonify(all_tasks)
+        return respond(all_tasks)
 
     except Exception as e:
         print(f"🔥❌ Error inside /tasks route: {e}"); traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        return respond({"error": str(e)}), 500
 
 @app.route("/create-list", methods=["POST", "OPTIONS"])
 @check_token
 def create_list():
-    if not db: return jsonify({"message": "❌ Database not initialized."}), 500
+    if not db: return respond({"message": "❌ Database not initialized."}), 500
     try:
         data = request.get_json()
         if not data or not data.get("name"):
-            return jsonify({"message": "❌ List name is required."}), 400
+            return respond({"message": "❌ List name is required."}), 400
         
         user_id = request.user["uid"]
         user_email = request.user.get("email", user_id)
@@ -451,26 +510,26 @@ def create_list():
         
         created_list_data = payload.copy()
         created_list_data["id"] = list_ref.id
-        created_list_data["created_at"] = update_time.isoformat()
+        created_list_data["created_at"] = update_time
 
         print(f"✅ User {user_id} created shared list '{list_name}' with ID: {list_ref.id}")
-        return jsonify({"message": f"✅ List '{list_name}' created.", "list": created_list_data}), 201
+        return respond({"message": f"✅ List '{list_name}' created.", "list": created_list_data}), 201
 
     except Exception as e:
         print(f"🔥❌ /create-list Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to create list.", "details": str(e)}), 500
+        return respond({"error": "Failed to create list.", "details": str(e)}), 500
 
 @app.route("/invite", methods=["POST", "OPTIONS"])
 @check_token
 def invite_user_to_list():
-    if not db: return jsonify({"error": "Database not initialized"}), 500
+    if not db: return respond({"error": "Database not initialized"}), 500
     
     data = request.get_json()
     list_id = data.get("listId")
     invitee_email = data.get("email", "").strip().lower()
 
     if not list_id or not invitee_email:
-        return jsonify({"error": "listId and email are required"}), 400
+        return respond({"error": "listId and email are required"}), 400
 
     user_email = request.user.get("email")
 
@@ -478,29 +537,29 @@ def invite_user_to_list():
     list_doc = list_ref.get()
 
     if not list_doc.exists:
-        return jsonify({"error": "List not found"}), 404
+        return respond({"error": "List not found"}), 404
 
     list_data = list_doc.to_dict()
     members = list_data.get("members", [])
     
     if user_email not in members:
-        return jsonify({"error": "You must be a member of this list to invite others."}), 403
+        return respond({"error": "You must be a member of this list to invite others."}), 403
 
     if invitee_email in members:
-        return jsonify({"message": "User is already a member of this list."}), 200
+        return respond({"message": "User is already a member of this list."}), 200
 
     list_ref.update({"pending_invites": firestore.ArrayUnion([invitee_email])})
 
-    return jsonify({"message": f"Successfully sent an invitation to {invitee_email} for list '{list_data.get('name', list_id)}'"}), 200
+    return respond({"message": f"Successfully sent an invitation to {invitee_email} for list '{list_data.get('name', list_id)}'"}), 200
 
 @app.route("/invites", methods=["GET", "OPTIONS"])
 @check_token
 def get_invites():
-    if not db: return jsonify({"error": "Database not initialized"}), 500
+    if not db: return respond({"error": "Database not initialized"}), 500
     
     user_email = request.user.get("email")
     if not user_email:
-        return jsonify({"error": "User email not found in token."}), 400
+        return respond({"error": "User email not found in token."}), 400
 
     invites = []
     query = db.collection("shared_lists").where("pending_invites", "array_contains", user_email).where("deleted", "==", False)
@@ -514,49 +573,49 @@ def get_invites():
                 "name": data.get("name", "Untitled List"),
                 "owner_id": data.get("owner_id")
             })
-        return jsonify({"invites": invites}), 200
+        return respond({"invites": invites}), 200
     except Exception as e:
         print(f"🔥❌ /invites Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to retrieve invitations.", "details": str(e)}), 500
+        return respond({"error": "Failed to retrieve invitations.", "details": str(e)}), 500
 
 
 @app.route('/accept-invite', methods=['POST', 'OPTIONS'])
 @check_token
 def accept_invite():
-    if not db: return jsonify({"error": "Database not initialized"}), 500
+    if not db: return respond({"error": "Database not initialized"}), 500
     
     data = request.get_json()
     list_id = data.get('listId')
     user_email = request.user.get('email')
 
     if not list_id or not user_email:
-        return jsonify({'error': 'Missing listId or user email from token'}), 400
+        return respond({'error': 'Missing listId or user email from token'}), 400
 
     list_ref = db.collection('shared_lists').document(list_id)
     list_doc = list_ref.get()
 
     if not list_doc.exists:
-        return jsonify({'error': 'List not found'}), 404
+        return respond({'error': 'List not found'}), 404
     
     list_data = list_doc.to_dict()
     if user_email not in list_data.get("pending_invites", []):
-        return jsonify({"error": "No pending invitation found for this list."}), 403
+        return respond({"error": "No pending invitation found for this list."}), 403
 
     list_ref.update({
         "pending_invites": firestore.ArrayRemove([user_email]),
         "members": firestore.ArrayUnion([user_email])
     })
 
-    return jsonify({'message': 'Successfully joined the shared list'}), 200
+    return respond({'message': 'Successfully joined the shared list'}), 200
 
 @app.route("/create-task", methods=["POST", "OPTIONS"])
 @check_token
 def create_task():
-    if not db: return jsonify({"message": "❌ Database not initialized."}), 500
+    if not db: return respond({"message": "❌ Database not initialized."}), 500
 
     try:
         data = request.get_json()
-        if not data: return jsonify({"message": "❌ No JSON data received."}), 400
+        if not data: return respond({"message": "❌ No JSON data received."}), 400
         
         user_id = request.user["uid"]
         user_email = request.user.get("email", user_id)
@@ -575,27 +634,29 @@ def create_task():
         if task_type == "personal":
             ref = db.collection("users").document(user_id).collection("personal_tasks")
             _ , doc_ref = ref.add(task_payload)
-            return jsonify({"message": "✅ Personal task created.", "id": doc_ref.id}), 201
+            return respond({"message": "✅ Personal task created.", "id": doc_ref.id}), 201
         
         elif task_type == "shared":
             list_id = data.get("list_id")
-            if not list_id: return jsonify({"message": "❌ Missing 'list_id' for shared task."}), 400
+            if not list_id: return respond({"message": "❌ Missing 'list_id' for shared task."}), 400
             
             list_ref = db.collection("shared_lists").document(list_id)
             list_doc = list_ref.get()
-            if not list_doc.exists: return jsonify({"message": f"❌ Shared list '{list_id}' not found."}), 404
+            # Deleted lists are compacted later; tasks added now would be orphaned.
+            if not list_doc.exists or list_doc.to_dict().get("deleted"):
+                return respond({"message": f"❌ Shared list '{list_id}' not found."}), 404
             
             if user_email not in list_doc.to_dict().get("members", []):
-                return jsonify({"message": "You are not authorized to add tasks to this list."}), 403
+                return respond({"message": "You are not authorized to add tasks to this list."}), 403
 
             _ , doc_ref = list_ref.collection("tasks").add(task_payload)
-            return jsonify({"message": "✅ Shared task created.", "id": doc_ref.id}), 201
+            return respond({"message": "✅ Shared task created.", "id": doc_ref.id}), 201
         else:
-            return jsonify({"message": f"❌ Invalid task type: {task_type}."}), 400
+            return respond({"message": f"❌ Invalid task type: {task_type}."}), 400
 
     except Exception as e:
         print(f"🔥❌ /create-task Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to create task.", "details": str(e)}), 500
+        return respond({"error": "Failed to create task.", "details": str(e)}), 500
 
 def update_task_generic(ref, data):
     updates = {}
@@ -605,99 +666,119 @@ def update_task_generic(ref, data):
     if "status" in data: updates["status"] = data["status"]
     if "assignee" in data: updates["assignee"] = data["assignee"]
     
-    if not updates: return jsonify({"message": "No update fields provided"}), 400
+    if not updates: return respond({"message": "No update fields provided"}), 400
     
     updates["updated_at"] = firestore.SERVER_TIMESTAMP
     ref.update(updates)
-    return jsonify({"message": f"✅ Task updated."}), 200
+    return respond({"message": f"✅ Task updated."}), 200
 
 @app.route("/update-personal-task/<task_id>", methods=["PUT", "OPTIONS"])
 @check_token
 def update_personal_task(task_id):
-    if not db: return jsonify({"message": "❌ DB not initialized."}), 500
+    if not db: return respond({"message": "❌ DB not initialized."}), 500
     try:
         user_id = request.user["uid"]
         ref = db.collection("users").document(user_id).collection("personal_tasks").document(task_id)
-        if not ref.get().exists: return jsonify({"message": "Task not found"}), 404
+        if not ref.get().exists: return respond({"message": "Task not found"}), 404
         return update_task_generic(ref, request.get_json())
     except Exception as e:
         print(f"🔥❌ /update-personal-task Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to update task.", "details": str(e)}), 500
+        return respond({"error": "Failed to update task.", "details": str(e)}), 500
 
 @app.route("/update-shared-task/<list_id>/<task_id>", methods=["PUT", "OPTIONS"])
 @check_token
 def update_shared_task(list_id, task_id):
-    if not db: return jsonify({"message": "❌ DB not initialized."}), 500
+    if not db: return respond({"message": "❌ DB not initialized."}), 500
     try:
         user_email = request.user.get("email")
         list_ref = db.collection("shared_lists").document(list_id)
         list_doc = list_ref.get()
 
-        if not list_doc.exists: return jsonify({"message": "List not found"}), 404
+        if not list_doc.exists: return respond({"message": "List not found"}), 404
         if user_email not in list_doc.to_dict().get("members", []):
-            return jsonify({"message": "You are not authorized to modify tasks in this list."}), 403
+            return respond({"message": "You are not authorized to modify tasks in this list."}), 403
 
         ref = list_ref.collection("tasks").document(task_id)
-        if not ref.get().exists: return jsonify({"message": "Task not found"}), 404
+        if not ref.get().exists: return respond({"message": "Task not found"}), 404
         return update_task_generic(ref, request.get_json())
     except Exception as e:
         print(f"🔥❌ /update-shared-task Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to update task.", "details": str(e)}), 500
+        return respond({"error": "Failed to update task.", "details": str(e)}), 500
 
 def delete_task_generic(ref):
-    if not ref.get().exists: return jsonify({"message": "Task not found"}), 404
+    if not ref.get().exists: return respond({"message": "Task not found"}), 404
     ref.update({"deleted": True, "deleted_at": firestore.SERVER_TIMESTAMP})
-    return jsonify({"message": f"✅ Task deleted."}), 200
+    return respond({"message": f"✅ Task deleted."}), 200
 
 @app.route("/delete-personal-task/<task_id>", methods=["DELETE", "OPTIONS"])
 @check_token
 def delete_personal_task(task_id):
-    if not db: return jsonify({"message": "❌ DB not initialized."}), 500
+    if not db: return respond({"message": "❌ DB not initialized."}), 500
     try:
         user_id = request.user["uid"]
         ref = db.collection("users").document(user_id).collection("personal_tasks").document(task_id)
         return delete_task_generic(ref)
     except Exception as e:
         print(f"🔥❌ /delete-personal-task Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to delete task.", "details": str(e)}), 500
+        return respond({"error": "Failed to delete task.", "details": str(e)}), 500
 
 @app.route("/delete-shared-task/<list_id>/<task_id>", methods=["DELETE", "OPTIONS"])
 @check_token
 def delete_shared_task(list_id, task_id):
-    if not db: return jsonify({"message": "❌ DB not initialized."}), 500
+    if not db: return respond({"message": "❌ DB not initialized."}), 500
     try:
         user_email = request.user.get("email")
         list_ref = db.collection("shared_lists").document(list_id)
         list_doc = list_ref.get()
 
-        if not list_doc.exists: return jsonify({"message": "List not found"}), 404
+        if not list_doc.exists: return respond({"message": "List not found"}), 404
         if user_email not in list_doc.to_dict().get("members", []):
-            return jsonify({"message": "You are not authorized to delete tasks in this list."}), 403
+            return respond({"message": "You are not authorized to delete tasks in this list."}), 403
         
         ref = list_ref.collection("tasks").document(task_id)
         return delete_task_generic(ref)
     except Exception as e:
         print(f"🔥❌ /delete-shared-task Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to delete task.", "details": str(e)}), 500
+        return respond({"error": "Failed to delete task.", "details": str(e)}), 500
 
 @app.route("/delete-list/<list_id>", methods=["DELETE", "OPTIONS"])
 @check_token
 def delete_list(list_id):
-    if not db: return jsonify({"message": "❌ DB not initialized."}), 500
+    if not db: return respond({"message": "❌ DB not initialized."}), 500
     try:
         user_id = request.user["uid"]
         list_ref = db.collection("shared_lists").document(list_id)
         list_doc = list_ref.get()
-        if not list_doc.exists: return jsonify({"message": "List not found"}), 404
+        if not list_doc.exists: return respond({"message": "List not found"}), 404
         
         if list_doc.to_dict().get("owner_id") != user_id:
-            return jsonify({"message": "Only the list owner can delete this list."}), 403
+            return respond({"message": "Only the list owner can delete this list."}), 403
 
         list_ref.update({"deleted": True, "deleted_at": firestore.SERVER_TIMESTAMP})
-        return jsonify({"message": f"✅ List deleted."}), 200
+        return respond({"message": f"✅ List deleted."}), 200
     except Exception as e:
         print(f"🔥❌ /delete-list Error: {e}"); traceback.print_exc()
-        return jsonify({"error": "Failed to delete list.", "details": str(e)}), 500
+        return respond({"error": "Failed to delete list.", "details": str(e)}), 500
+
+# === MAINTENANCE COMMANDS ===
+# Run with: flask --app app compact-tombstones --retention-days 30
+@app.cli.command("compact-tombstones")
+@click.option("--retention-days", type=int, default=30, show_default=True, envvar="COMPACTION_RETENTION_DAYS",
+              help="Only compact tombstones deleted more than this many days ago.")
+@click.option("--mode", type=click.Choice(["delete", "archive"]), default="delete", show_default=True,
+              help="Hard-delete tombstones, or copy them to 'archived_documents' before deleting.")
+@click.option("--batch-size", type=int, default=200, show_default=True, help="Documents per batch commit.")
+@click.option("--pause", type=float, default=1.0, show_default=True, help="Seconds to sleep between batches.")
+@click.option("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, show_default=True,
+              help="Progress file used to resume an interrupted run.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be reclaimed.")
+def compact_tombstones(retention_days, mode, batch_size, pause, checkpoint, dry_run):
+    """Hard-deletes or archives soft-deleted lists and tasks past the retention period."""
+    if not db:
+        raise click.ClickException("❌ Database not initialized. Cannot compact tombstones.")
+    compactor = TombstoneCompactor(db, retention_days=retention_days, mode=mode, batch_size=batch_size,
+                                   pause_seconds=pause, checkpoint_path=checkpoint, dry_run=dry_run)
+    compactor.run()
 
 # === RUN SERVER ===
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+"""
+Benchmarks response serialization per route.
+
+Builds payloads shaped like the real responses (Firestore task dicts with
+DatetimeWithNanoseconds-style timestamps) and reports encode time and payload
+size for Flask's jsonify (debug and compact settings), the fast JSON path and MessagePack.
+
+Usage: python bench_serialization.py [--tasks 2000] [--repeat 50]
+"""
+import argparse
+import datetime
+import email.utils
+import json
+import random
+import timeit
+
+import serialization
+
+
+class FakeDatetimeWithNanoseconds(datetime.datetime):
+    """Stands in for google.api_core's DatetimeWithNanoseconds without needing the SDK."""
+
+
+STATUSES = ["highpriority", "todo", "inprogress", "review", "completed"]
+
+
+def _timestamp(rng):
+    base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    ts = base + datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+    return FakeDatetimeWithNanoseconds(ts.year, ts.month, ts.day, ts.hour, ts.minute, ts.second,
+                                       rng.randint(0, 999999), tzinfo=datetime.timezone.utc)
+
+
+def make_task(rng, i, shared):
+    task = {
+        "id": f"task{i:06d}",
+        "title": f"Follow up on action item #{i}",
+        "description": "Context gathered from the meeting transcript. " * rng.randint(1, 4),
+        "assignee": f"user{rng.randint(0, 20)}@example.com",
+        "due_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "status": rng.choice(STATUSES),
+        "deleted": False,
+        "created_at": _timestamp(rng),
+        "source": "transcript",
+    }
+    if rng.random() < 0.5:
+        task["updated_at"] = _timestamp(rng)
+    if shared:
+        task["list_id"] = f"list{rng.randint(0, 50):04d}"
+        task["list_name"] = "Quarterly planning"
+    return task
+
+
+def build_payloads(num_tasks):
+    rng = random.Random(42)
+    return {
+        "/tasks": [make_task(rng, i, shared=i % 2 == 1) for i in range(num_tasks)],
+        "/invites": {"invites": [
+            {"list_id": f"list{i:04d}", "name": f"Shared list {i}", "owner_id": f"uid{i}"}
+            for i in range(50)
+        ]},
+        "/create-list": {"message": "✅ List 'Roadmap' created.", "list": {
+            "id": "list0001", "name": "Roadmap", "created_at": _timestamp(rng),
+            "deleted": False, "owner_id": "uid1", "members": ["user1@example.com"], "pending_invites": [],
+        }},
+        "/suggest-status": {"suggested_status": "In Progress"},
+    }
+
+
+def _http_date(value):
+    # werkzeug.http.http_date: naive values are UTC, dates are midnight UTC.
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return email.utils.format_datetime(value.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def _jsonify_default(obj):
+    # Mirrors flask.json.provider._default, which formats dates as HTTP dates.
+    if isinstance(obj, datetime.date):
+        return _http_date(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _flask_jsonify(payload, **dump_args):
+    # Same settings as Flask's DefaultJSONProvider.dumps/response: ASCII-escaped,
+    # sorted keys and a trailing newline.
+    body = json.dumps(payload, default=_jsonify_default, ensure_ascii=True, sort_keys=True, **dump_args)
+    return f"{body}\n".encode("utf-8")
+
+
+def jsonify_debug(payload):
+    # app.run(debug=True) makes jsonify pretty-print, which is what the app did before.
+    return _flask_jsonify(payload, indent=2)
+
+
+def jsonify_compact(payload):
+    # jsonify without debug mode.
+    return _flask_jsonify(payload, separators=(",", ":"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=2000, help="number of tasks in the /tasks payload")
+    parser.add_argument("--repeat", type=int, default=50, help="encodes per measurement")
+    args = parser.parse_args()
+
+    encoders = [("jsonify (debug, indent=2)", jsonify_debug), ("jsonify (compact)", jsonify_compact)]
+    encoders.append(("fast json (orjson)" if serialization.orjson else "fast json (stdlib fallback)",
+                     serialization.dumps_json))
+    if serialization.msgpack is not None:
+        encoders.append(("msgpack", serialization.dumps_msgpack))
+    else:
+        print("⚠️ msgpack not installed, skipping MessagePack measurements.")
+
+    print(f"{'route':<16} {'encoder':<28} {'ms/encode':>10} {'bytes':>10}")
+    for route, payload in build_payloads(args.tasks).items():
+        for name, encode in encoders:
+            size = len(encode(payload))
+            seconds = min(timeit.repeat(lambda: encode(payload), number=args.repeat, repeat=3)) / args.repeat
+            print(f"{route:<16} {name:<28} {seconds * 1000:>10.3f} {size:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Tombstone compaction for soft-deleted lists and tasks.
+
+Routes only flag documents with `deleted: True`. This job hard-deletes (or
+archives) tombstones once they are older than the retention period:
+
+1. shared_lists tombstones, cascading to every document in their `tasks`
+   subcollection first,
+2. tombstoned shared tasks (collection group `tasks`),
+3. tombstoned personal tasks (collection group `personal_tasks`).
+
+Work runs in chunked batches with a pause between commits. Progress is saved
+to a JSON checkpoint after every batch so an interrupted run picks up where it
+stopped.
+
+The equality filter on `deleted` plus the range filter on `deleted_at` needs
+three composite indexes on (`deleted` ASC, `deleted_at` ASC):
+- collection `shared_lists`,
+- collection group `tasks`,
+- collection group `personal_tasks`.
+"""
+import datetime
+import json
+import os
+import time
+
+# Firestore allows at most 500 writes per batch; archiving costs two per document.
+MAX_BATCH_WRITES = 500
+ARCHIVE_COLLECTION = "archived_documents"
+
+PHASES = ("lists", "shared_tasks", "personal_tasks")
+
+# Next to this file (like ServiceAccountKey.json), not the current directory.
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compaction_checkpoint.json")
+
+
+# === DOCUMENT SIZE ESTIMATION ===
+# Follows https://firebase.google.com/docs/firestore/storage-size
+def _value_size(value) -> int:
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime.datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_value_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(len(str(k).encode("utf-8")) + 1 + _value_size(v) for k, v in value.items())
+    if hasattr(value, "path"):  # DocumentReference
+        return _document_name_size(value.path)
+    if hasattr(value, "latitude"):  # GeoPoint
+        return 16
+    return len(str(value).encode("utf-8")) + 1
+
+
+def _document_name_size(path: str) -> int:
+    return sum(len(segment.encode("utf-8")) + 1 for segment in path.split("/")) + 16
+
+
+def estimate_document_size(path: str, data: dict) -> int:
+    """Approximate stored size in bytes of a document, excluding indexes."""
+    return _document_name_size(path) + _value_size(data or {}) + 32
+
+
+# === CHECKPOINTS ===
+def load_checkpoint(path: str, mode: str):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("mode") != mode:
+        print(f"⚠️ Ignoring checkpoint {path}: it was written by a '{checkpoint.get('mode')}' run.")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _new_stats():
+    return {phase: {"documents": 0, "bytes": 0} for phase in PHASES + ("cascaded_tasks",)}
+
+
+# === COMPACTOR ===
+class TombstoneCompactor:
+    def __init__(self, db, retention_days=30, mode="delete", batch_size=200, pause_seconds=1.0,
+                 checkpoint_path=DEFAULT_CHECKPOINT_PATH, dry_run=False):
+        if mode not in ("delete", "archive"):
+            raise ValueError(f"Invalid compaction mode: {mode}")
+        self.db = db
+        self.mode = mode
+        self.dry_run = dry_run
+        self.pause_seconds = pause_seconds
+        self.retention_days = retention_days
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        # Expired lists seen in the lists phase. A dry run deletes nothing, so their
+        # tombstoned tasks would otherwise be counted again by the shared_tasks phase.
+        self.compacted_list_paths = set()
+        max_docs = MAX_BATCH_WRITES // 2 if mode == "archive" else MAX_BATCH_WRITES
+        self.batch_size = max(1, min(batch_size, max_docs))
+        # Dry runs don't remove anything, so resuming from a checkpoint makes no sense.
+        self.checkpoint_path = None if dry_run else checkpoint_path
+
+        checkpoint = load_checkpoint(self.checkpoint_path, mode)
+        if checkpoint:
+            # Keep the original cutoff so a resumed run sees the same set of tombstones.
+            self.cutoff = datetime.datetime.fromisoformat(checkpoint["cutoff"])
+            self.completed_phases = checkpoint["completed_phases"]
+            self.stats = checkpoint["stats"]
+            if checkpoint.get("retention_days") != retention_days:
+                print(f"⚠️ Ignoring --retention-days {retention_days}: the checkpoint was written with "
+                      f"{checkpoint.get('retention_days')} day(s) and keeps its cutoff "
+                      f"{self.cutoff.isoformat()}. Delete {self.checkpoint_path} to start over.")
+            print(f"🔁 Resuming compaction from checkpoint {self.checkpoint_path} "
+                  f"(completed: {', '.join(self.completed_phases) or 'none'}).")
+        else:
+            self.cutoff = self.started_at - datetime.timedelta(days=retention_days)
+            self.completed_phases = []
+            self.stats = _new_stats()
+
+    def _checkpoint(self):
+        save_checkpoint(self.checkpoint_path, {
+            "mode": self.mode,
+            "cutoff": self.cutoff.isoformat(),
+            "retention_days": self.retention_days,
+            "completed_phases": self.completed_phases,
+            "stats": self.stats,
+        })
+
+    def _expired_tombstones(self, query):
+        return query.where("deleted", "==", True).where("deleted_at", "<", self.cutoff)
+
+    def _remove_chunk(self, docs, stat_key):
+        """Deletes or archives one chunk of document snapshots in a single batch."""
+        batch = self.db.batch()
+        for doc in docs:
+            data = doc.to_dict() or {}
+            if self.mode == "archive":
+                batch.set(self.db.collection(ARCHIVE_COLLECTION).document(), {
+                    "path": doc.reference.path,
+                    "kind": stat_key,
+                    "data": data,
+                    "archived_at": self.started_at,
+                })
+            batch.delete(doc.reference)
+            self.stats[stat_key]["documents"] += 1
+            self.stats[stat_key]["bytes"] += estimate_document_size(doc.reference.path, data)
+        if not self.dry_run:
+            batch.commit()
+            self._checkpoint()
+            time.sleep(self.pause_seconds)
+
+    def _chunks(self, query):
+        """
+        Yields lists of at most batch_size snapshots matched by `query`.
+        Removed documents drop out of the query, so re-running it is the
+        resume cursor; dry runs remove nothing and read the query once instead.
+        """
+        if self.dry_run:
+            docs = list(query.stream())
+            for start in range(0, len(docs), self.batch_size):
+                yield docs[start:start + self.batch_size]
+            return
+        while True:
+            docs = list(query.limit(self.batch_size).stream())
+            if not docs:
+                return
+            yield docs
+
+    def _drain(self, query, stat_key):
+        for docs in self._chunks(query):
+            self._remove_chunk(docs, stat_key)
+
+    def _drain_shared_tasks(self):
+        query = self._expired_tombstones(self.db.collection_group("tasks"))
+        for docs in self._chunks(query):
+            if self.dry_run:
+                # Filtering only in dry runs: in a real run these are already gone, and
+                # skipping live matches would make _chunks return them forever.
+                docs = [doc for doc in docs
+                        if doc.reference.parent.parent.path not in self.compacted_list_paths]
+            if docs:
+                self._remove_chunk(docs, "shared_tasks")
+
+    def _compact_lists(self):
+        lists_query = self._expired_tombstones(self.db.collection("shared_lists"))
+        for list_docs in self._chunks(lists_query):
+            for list_doc in list_docs:
+                # Every task of a deleted list goes, tombstoned or not.
+                self._drain(list_doc.reference.collection("tasks"), "cascaded_tasks")
+                self.compacted_list_paths.add(list_doc.reference.path)
+            if not self.dry_run:
+                # Catch tasks written to a list while its chunk was being drained.
+                for list_doc in list_docs:
+                    self._drain(list_doc.reference.collection("tasks"), "cascaded_tasks")
+            self._remove_chunk(list_docs, "lists")
+
+    def run(self):
+        phase_runners = {
+            "lists": self._compact_lists,
+            "shared_tasks": self._drain_shared_tasks,
+            "personal_tasks": lambda: self._drain(
+                self._expired_tombstones(self.db.collection_group("personal_tasks")), "personal_tasks"),
+        }
+        print(f"🧹 Compacting tombstones deleted before {self.cutoff.isoformat()} "
+              f"(mode={self.mode}, batch_size={self.batch_size}{', dry run' if self.dry_run else ''})")
+        for phase in PHASES:
+            if phase in self.completed_phases:
+                continue
+            print(f"🟡 Compaction phase: {phase}")
+            phase_runners[phase]()
+            if not self.dry_run:
+                self.completed_phases.append(phase)
+                self._checkpoint()
+
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return self.report()
+
+    def report(self):
+        total_docs = sum(s["documents"] for s in self.stats.values())
+        total_bytes = sum(s["bytes"] for s in self.stats.values())
+        verb = "Would reclaim" if self.dry_run else "Reclaimed"
+        for key, s in self.stats.items():
+            print(f"   {key:<15} {s['documents']:>8} docs {s['bytes']:>12} bytes")
+        print(f"✅ {verb} {total_docs} document(s), ~{total_bytes} bytes (excluding indexes).")
+        return {"documents": total_docs, "bytes": total_bytes, "by_kind": self.stats}
@@ -0,0 +1,98 @@
+"""
+Versioned Gemini prompt templates.
+
+The static instructions of each prompt are kept apart from the per-call values
+and passed as the model's system instruction. Gemini still receives that
+instruction with every request and bills it in `prompt_token_count`, so this
+organizes the prompt but does not reduce input tokens. Explicit context
+caching would, but it needs at least 32k tokens, far more than these prompts.
+Bump `version`
+whenever the wording or schema changes so token usage and latency recorded in
+`llm_usage` can be compared across prompt versions.
+"""
+
+VALID_STATUSES = ["High Priority", "To Do", "In Progress", "Review", "Completed"]
+
+
+class PromptTemplate:
+    def __init__(self, name, version, system_instruction, user_template, response_schema):
+        self.name = name
+        self.version = version
+        self.system_instruction = system_instruction.strip()
+        self.user_template = user_template.strip()
+        self.response_schema = response_schema
+
+    @property
+    def id(self):
+        return f"{self.name}@{self.version}"
+
+    @property
+    def generation_config(self):
+        # Structured output: Gemini returns JSON matching the schema, no free-text parsing.
+        return {"response_mime_type": "application/json", "response_schema": self.response_schema}
+
+    def render(self, **values):
+        return self.user_template.format(**values)
+
+
+# === TASK EXTRACTION (/upload) ===
+TASK_EXTRACTION = PromptTemplate(
+    name="extract_tasks",
+    version="v2",
+    system_instruction="""
+You are a hyper-attentive Task Analyst Engine. You extract every task from a meeting transcript under a **Zero-Miss Directive** and describe each one under a **Full-Context Mandate**.
+
+1. **Identification:** Any statement implying future work is a task: direct commands ("Send me the file"), pledges ("I will do it") and implied actions.
+2. **description:** The 'why' behind the task, taken from the surrounding sentences. Use "" if there is no context.
+3. **status:** Exactly one of `High Priority`, `To Do`, `In Progress`, `Review`, `Completed`.
+   * `High Priority`: "urgent", "ASAP", "critical", "immediately", "top priority", "needs to be done first".
+   * `In Progress`: the speaker says the work has already started.
+   * `Review`: checking, approving or reviewing someone else's work.
+   * `Completed`: the speaker explicitly says it is already finished.
+   * `To Do`: the default for everything else.
+4. **task:** The concise imperative command (e.g. "Draft the Q3 marketing report").
+5. **assignee:** The responsible person or team, or "Unassigned".
+6. **deadline:** A `YYYY-MM-DD` date. Resolve relative dates ("tomorrow", "next Friday", "end of the month") against the meeting date given with the transcript. Use "" if no deadline is mentioned.
+""",
+    user_template="""
+Meeting date: {meeting_date}
+
+Transcript:
+{transcript}
+""",
+    response_schema={
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {
+                "task": {"type": "STRING"},
+                "assignee": {"type": "STRING"},
+                "deadline": {"type": "STRING"},
+                "description": {"type": "STRING"},
+                "status": {"type": "STRING", "enum": VALID_STATUSES},
+            },
+            "required": ["task", "assignee", "deadline", "description", "status"],
+        },
+    },
+)
+
+# === STATUS SUGGESTION (/suggest-status) ===
+STATUS_SUGGESTION = PromptTemplate(
+    name="suggest_status",
+    version="v2",
+    system_instruction="""
+Suggest the most appropriate status for a task from its title and description.
+Keywords like 'urgent', 'review', 'already started' or 'finished' should guide your choice. Default to 'To Do' if no other status fits.
+""",
+    user_template="""
+Task Title: "{title}"
+Task Description: "{description}"
+""",
+    response_schema={
+        "type": "OBJECT",
+        "properties": {
+            "suggested_status": {"type": "STRING", "enum": VALID_STATUSES},
+        },
+        "required": ["suggested_status"],
+    },
+)
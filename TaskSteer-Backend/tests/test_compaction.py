@@ -0,0 +1,224 @@
+import datetime
+import itertools
+import json
+
+import pytest
+
+import compaction
+
+UTC = datetime.timezone.utc
+LONG_AGO = datetime.datetime(2020, 1, 1, tzinfo=UTC)
+
+
+# === IN-MEMORY FIRESTORE ===
+class FakeDocumentReference:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeQuery(self.db, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name):
+        return FakeQuery(self.db, f"{self.path}/{name}")
+
+
+class FakeSnapshot:
+    def __init__(self, db, path):
+        self.reference = FakeDocumentReference(db, path)
+        self.id = self.reference.id
+        self._data = dict(db.store[path])
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeQuery:
+    def __init__(self, db, path, group=False, filters=(), limit=None):
+        self.db = db
+        self.path = path
+        self.group = group
+        self.filters = filters
+        self._limit = limit
+
+    @property
+    def parent(self):
+        # Parent document of a collection, as on CollectionReference.
+        return FakeDocumentReference(self.db, self.path.rsplit("/", 1)[0])
+
+    def where(self, field, op, value):
+        return FakeQuery(self.db, self.path, self.group, self.filters + ((field, op, value),), self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self.db, self.path, self.group, self.filters, count)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self.db, f"{self.path}/{doc_id or f'auto{next(self.db.ids)}'}")
+
+    def _matches(self, path, data):
+        collection_path = path.rsplit("/", 1)[0]
+        if self.group:
+            if collection_path.rsplit("/", 1)[-1] != self.path:
+                return False
+        elif collection_path != self.path:
+            return False
+        for field, op, value in self.filters:
+            if field not in data:
+                return False
+            if op == "==" and data[field] != value:
+                return False
+            if op == "<" and not data[field] < value:
+                return False
+        return True
+
+    def stream(self):
+        docs = [FakeSnapshot(self.db, p) for p, d in sorted(self.db.store.items()) if self._matches(p, d)]
+        return iter(docs[:self._limit] if self._limit else docs)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, data):
+        self.ops.append((ref.path, data))
+
+    def delete(self, ref):
+        self.ops.append((ref.path, None))
+
+    def commit(self):
+        assert len(self.ops) <= compaction.MAX_BATCH_WRITES
+        self.db.commits.append(self.ops)
+        for path, data in self.ops:
+            if data is None:
+                self.db.store.pop(path, None)
+            else:
+                self.db.store[path] = data
+
+
+class FakeFirestore:
+    def __init__(self, store=None):
+        self.store = dict(store or {})
+        self.commits = []
+        self.ids = itertools.count()
+
+    def collection(self, name):
+        return FakeQuery(self, name)
+
+    def collection_group(self, name):
+        return FakeQuery(self, name, group=True)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def tombstone(**fields):
+    return {"deleted": True, "deleted_at": LONG_AGO, **fields}
+
+
+def live(**fields):
+    return {"deleted": False, **fields}
+
+
+def make_compactor(db, tmp_path, **kwargs):
+    kwargs.setdefault("pause_seconds", 0)
+    kwargs.setdefault("checkpoint_path", str(tmp_path / "checkpoint.json"))
+    return compaction.TombstoneCompactor(db, **kwargs)
+
+
+@pytest.fixture
+def mixed_store():
+    return {
+        # Expired list: both its live and tombstoned tasks go with it.
+        "shared_lists/old": tombstone(name="Old"),
+        "shared_lists/old/tasks/live": live(title="a"),
+        "shared_lists/old/tasks/gone": tombstone(title="b"),
+        # Live list: only its expired tombstone goes.
+        "shared_lists/keep": live(name="Keep"),
+        "shared_lists/keep/tasks/gone": tombstone(title="c"),
+        "shared_lists/keep/tasks/recent": tombstone(title="d", deleted_at=datetime.datetime.now(UTC)),
+        "shared_lists/keep/tasks/live": live(title="e"),
+        "users/u1/personal_tasks/gone": tombstone(title="f"),
+        "users/u1/personal_tasks/live": live(title="g"),
+    }
+
+
+# === TESTS ===
+def test_cascade_removes_live_tasks_of_expired_list(mixed_store, tmp_path):
+    db = FakeFirestore(mixed_store)
+    result = make_compactor(db, tmp_path).run()
+
+    assert sorted(db.store) == [
+        "shared_lists/keep",
+        "shared_lists/keep/tasks/live",
+        "shared_lists/keep/tasks/recent",
+        "users/u1/personal_tasks/live",
+    ]
+    assert result["documents"] == 5
+    assert result["by_kind"]["cascaded_tasks"]["documents"] == 2
+    assert not (tmp_path / "checkpoint.json").exists()
+
+
+def test_dry_run_totals_match_real_run(mixed_store, tmp_path):
+    db = FakeFirestore(mixed_store)
+    preview = make_compactor(db, tmp_path, dry_run=True).run()
+    assert db.store == mixed_store
+    assert db.commits == []
+
+    actual = make_compactor(db, tmp_path).run()
+    assert preview["documents"] == actual["documents"] == 5
+    assert preview["bytes"] == actual["bytes"]
+    assert preview["by_kind"] == actual["by_kind"]
+
+
+def test_chunks_at_batch_size(tmp_path):
+    db = FakeFirestore({f"users/u1/personal_tasks/t{i:02d}": tombstone() for i in range(7)})
+    make_compactor(db, tmp_path, batch_size=3).run()
+
+    assert [len(ops) for ops in db.commits] == [3, 3, 1]
+    assert db.store == {}
+
+
+def test_archive_mode_caps_batches_at_250_documents(tmp_path):
+    db = FakeFirestore({f"users/u1/personal_tasks/t{i:03d}": tombstone(title=str(i)) for i in range(260)})
+    compactor = make_compactor(db, tmp_path, mode="archive", batch_size=500)
+    assert compactor.batch_size == 250
+    compactor.run()
+
+    assert [len(ops) for ops in db.commits] == [500, 20]
+    archived = [d for p, d in db.store.items() if p.startswith(compaction.ARCHIVE_COLLECTION + "/")]
+    assert len(archived) == len(db.store) == 260
+    assert {d["kind"] for d in archived} == {"personal_tasks"}
+    assert archived[0]["data"]["deleted"] is True
+
+
+def test_resume_uses_stored_cutoff_and_completed_phases(tmp_path):
+    stored_cutoff = datetime.datetime(2021, 1, 1, tzinfo=UTC)
+    checkpoint_path = tmp_path / "checkpoint.json"
+    stats = compaction._new_stats()
+    stats["lists"] = {"documents": 4, "bytes": 400}
+    checkpoint_path.write_text(json.dumps({
+        "mode": "delete",
+        "cutoff": stored_cutoff.isoformat(),
+        "retention_days": 30,
+        "completed_phases": ["lists"],
+        "stats": stats,
+    }))
+    db = FakeFirestore({
+        # Would match the lists phase, but it is already complete.
+        "shared_lists/old": tombstone(),
+        "users/u1/personal_tasks/before": tombstone(),
+        # Newer than the stored cutoff, though older than a fresh cutoff would be.
+        "users/u1/personal_tasks/after": tombstone(deleted_at=datetime.datetime(2022, 1, 1, tzinfo=UTC)),
+    })
+
+    compactor = make_compactor(db, tmp_path, retention_days=0)
+    assert compactor.cutoff == stored_cutoff
+    result = compactor.run()
+
+    assert sorted(db.store) == ["shared_lists/old", "users/u1/personal_tasks/after"]
+    assert result["by_kind"]["lists"] == {"documents": 4, "bytes": 400}
+    assert result["by_kind"]["personal_tasks"]["documents"] == 1
@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+import serialization
+
+msgpack = pytest.importorskip("msgpack")
+werkzeug_datastructures = pytest.importorskip("werkzeug.datastructures")
+werkzeug_http = pytest.importorskip("werkzeug.http")
+
+
+def accept(header):
+    return werkzeug_http.parse_accept_header(header, werkzeug_datastructures.MIMEAccept)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("application/msgpack", "application/msgpack"),
+    ("application/x-msgpack", "application/x-msgpack"),
+    ("application/msgpack, */*;q=0.1", "application/msgpack"),
+    ("application/json;q=0.5, application/msgpack", "application/msgpack"),
+    ("application/json, application/msgpack;q=0.5", "application/json"),
+    ("application/json", "application/json"),
+    ("*/*", "application/json"),
+    ("", "application/json"),
+])
+def test_negotiate_mimetype(header, expected):
+    assert serialization.negotiate_mimetype(accept(header)) == expected
+
+
+def test_negotiate_mimetype_without_msgpack(monkeypatch):
+    monkeypatch.setattr(serialization, "msgpack", None)
+    assert serialization.negotiate_mimetype(accept("application/msgpack")) == "application/json"
+
+
+class DatetimeWithNanoseconds(datetime.datetime):
+    pass
+
+
+def test_msgpack_round_trip():
+    payload = [{
+        "title": "Draft report",
+        "deleted": False,
+        "created_at": DatetimeWithNanoseconds(2024, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc),
+        "members": ("a@example.com",),
+    }]
+    packed = serialization.serialize(payload, "application/msgpack")
+    assert msgpack.unpackb(packed, raw=False) == [{
+        "created_at": "2024-01-02T03:04:05.000006Z",
+        "deleted": False,
+        "members": ["a@example.com"],
+        "title": "Draft report",
+    }]
+
+
+def test_timestamps_share_one_utc_format():
+    plus_two = datetime.timezone(datetime.timedelta(hours=2))
+    encoded = serialization.dumps_json([
+        DatetimeWithNanoseconds(2024, 1, 2, 5, 4, 5, 6, tzinfo=plus_two),
+        datetime.datetime(2024, 1, 2, 3, 4, 5, 6),
+    ])
+    assert encoded == b'["2024-01-02T03:04:05.000006Z","2024-01-02T03:04:05.000006Z"]'
+
+
+def test_json_keys_are_sorted():
+    assert serialization.dumps_json({"b": 1, "a": {"d": 2, "c": 3}}) == b'{"a":{"c":3,"d":2},"b":1}'